@@ -1,10 +1,21 @@
 import os
 import stat
-from sqlalchemy import create_engine, event, Column, Integer, String
-from sqlalchemy.orm import declarative_base, sessionmaker
-from cryptography.fernet import Fernet
-from huggingface_hub import HfApi, hf_hub_download
-from huggingface_hub.utils import EntryNotFoundError
+import base64
+import shutil
+import threading
+from typing import Optional, Union
+import sqlite3
+from contextlib import closing
+from cachetools import LRUCache
+from sqlalchemy import event, select, Column, Integer, String
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import declarative_base
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.exceptions import InvalidTag
+from huggingface_hub import CommitScheduler, snapshot_download
 
 # 1. UNLOCK THE FOLDER: Ensure the entire /tmp directory is fully open
 os.makedirs('/tmp/', exist_ok=True)
@@ -13,25 +24,39 @@ try:
 except Exception:
     pass  # In case it fails (rarely), we proceed anyway
 
+DATA_DIR = "/tmp/voice-to-post"
+os.makedirs(DATA_DIR, exist_ok=True)
+# Consistent copies of the synced files; the commit scheduler uploads from here, never from DATA_DIR
+SYNC_DIR = "/tmp/voice-to-post-sync"
+os.makedirs(SYNC_DIR, exist_ok=True)
+
 DB_FILENAME = "credentials.db"
-DB_PATH = f"/tmp/{DB_FILENAME}"
-SQLALCHEMY_DATABASE_URL = f"sqlite:///{DB_PATH}"
+DB_PATH = f"{DATA_DIR}/{DB_FILENAME}"
+SQLALCHEMY_DATABASE_URL = f"sqlite+aiosqlite:///{DB_PATH}"
+
+# Vector store files, persisted next to the DB and synced with it
+INDEX_FILENAME = "faiss.index"
+INDEX_PATH = f"{DATA_DIR}/{INDEX_FILENAME}"
+TEXT_STORE_FILENAME = "faiss_texts.json"
+TEXT_STORE_PATH = f"{DATA_DIR}/{TEXT_STORE_FILENAME}"
+SYNCED_FILENAMES = (DB_FILENAME, INDEX_FILENAME, TEXT_STORE_FILENAME)
 
-# 2. TUNING THE ENGINE: Configure SQLite for better cloud compatibility
-engine = create_engine(
+# 2. TUNING THE ENGINE: Configure SQLite for better cloud compatibility (async via aiosqlite)
+engine = create_async_engine(
     SQLALCHEMY_DATABASE_URL,
-    connect_args={"check_same_thread": False, "timeout": 30}
+    connect_args={"timeout": 30}
 )
 
 # 3. THE MAGIC PRAGMA: Switch to Write-Ahead Logging (WAL)
-@event.listens_for(engine, "connect")
+@event.listens_for(engine.sync_engine, "connect")
 def set_sqlite_pragma(dbapi_connection, connection_record):
     cursor = dbapi_connection.cursor()
     cursor.execute("PRAGMA journal_mode=WAL")
     cursor.execute("PRAGMA synchronous=NORMAL")
     cursor.close()
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# expire_on_commit=False keeps loaded rows usable after the session closes
+SessionLocal = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
 class SocialCreds(Base):
@@ -57,73 +82,248 @@ if not ENV_KEY:
         "Generate one with: python -c 'from cryptography.fernet import Fernet; print(Fernet.generate_key().decode())'"
     )
 FERNET_KEY = ENV_KEY.encode('utf-8')
+# Validate once at import so a malformed key fails fast instead of on the first encrypt/decrypt
+try:
+    KEY_BYTES = base64.urlsafe_b64decode(FERNET_KEY)
+except ValueError:
+    KEY_BYTES = b""
+if len(KEY_BYTES) != 32:
+    raise ValueError(
+        "❌ CRITICAL: ENCRYPTION_KEY must be a URL-safe base64 encoded 32-byte key "
+        "(the format produced by Fernet.generate_key())."
+    )
+# Legacy Fernet cipher, only used to read rows written before the AES-GCM switch
 cipher_suite = Fernet(FERNET_KEY)
+# AES-256-GCM with its own key derived from ENCRYPTION_KEY, so the Fernet and AES-GCM keys
+# never share material; the instance is thread-safe and reused
+AES_KEY_INFO = b"voice-to-post/credentials/aes-256-gcm/v1"
+aes_cipher = AESGCM(HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=AES_KEY_INFO).derive(KEY_BYTES))
+NONCE_SIZE = 12
 
-def encrypt_secret(plain_text: str) -> str:
-    return cipher_suite.encrypt(plain_text.encode('utf-8')).decode('utf-8')
+ENCRYPTED_COLUMNS = ("twitter_access_token", "twitter_refresh_token", "linkedin_access_token")
 
-def decrypt_secret(encrypted_text: str) -> str:
-    return cipher_suite.decrypt(encrypted_text.encode('utf-8')).decode('utf-8')
+def encrypt_secret(plain_text: Union[str, bytes]) -> str:
+    """Encrypts with AES-256-GCM and stores nonce || ciphertext || tag as URL-safe base64."""
+    if isinstance(plain_text, str):
+        plain_text = plain_text.encode('utf-8')
+    nonce = os.urandom(NONCE_SIZE)
+    sealed = aes_cipher.encrypt(nonce, plain_text, None)
+    return base64.urlsafe_b64encode(nonce + sealed).decode('ascii')
 
-# Create tables
-Base.metadata.create_all(bind=engine)
+def decrypt_secret(encrypted_text: Union[str, bytes]) -> str:
+    plain_bytes = _aes_decrypt(encrypted_text)
+    if plain_bytes is None:
+        # Not an AES-GCM value – fall back to the legacy Fernet format
+        if isinstance(encrypted_text, str):
+            encrypted_text = encrypted_text.encode('utf-8')
+        plain_bytes = cipher_suite.decrypt(encrypted_text)
+    return plain_bytes.decode('utf-8')
+
+def _aes_decrypt(encrypted_text: Union[str, bytes]) -> Optional[bytes]:
+    """Returns the plaintext of an AES-GCM value, or None if it isn't one."""
+    try:
+        data = base64.urlsafe_b64decode(encrypted_text)
+        return aes_cipher.decrypt(data[:NONCE_SIZE], data[NONCE_SIZE:], None)
+    except (InvalidTag, ValueError):
+        return None
+
+async def init_db():
+    """Creates tables; called on startup after the DB has been downloaded."""
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
 
 # Hugging Face persistence
 HF_TOKEN = os.getenv("HF_TOKEN")
 HF_DATASET_REPO = "JessicaKumar/voice-to-post-data"
+# Minutes between background pushes; writes in between are shipped together in one commit
+HF_SYNC_EVERY_MINUTES = float(os.getenv("HF_SYNC_EVERY_MINUTES", "5"))
+commit_scheduler = None
 
 def download_db():
-    """Downloads credentials.db from HF Dataset into /tmp/ and ensures write permissions."""
+    """Downloads credentials.db and the vector store files from HF Dataset into DATA_DIR and ensures write permissions."""
     if not HF_TOKEN:
         print("WARNING: HF_TOKEN not set. Skipping cloud database download.")
         return
     try:
-        print(f"Attempting to download {DB_FILENAME} from dataset {HF_DATASET_REPO} to /tmp/...")
-        hf_hub_download(
+        print(f"Attempting to download {', '.join(SYNCED_FILENAMES)} from dataset {HF_DATASET_REPO} to {DATA_DIR}...")
+        # Fetches all synced files concurrently in one call; files missing from the dataset are skipped
+        snapshot_download(
             repo_id=HF_DATASET_REPO,
-            filename=DB_FILENAME,
             repo_type="dataset",
+            allow_patterns=list(SYNCED_FILENAMES),
             token=HF_TOKEN,
-            local_dir="/tmp/"
+            local_dir=DATA_DIR
         )
-        print(f"Successfully downloaded DB to {DB_PATH}")
-
-        # Force file to be writable by the current process
-        if os.path.exists(DB_PATH):
-            os.chmod(DB_PATH, stat.S_IRWXU | stat.S_IRWXG | stat.S_IRWXO)
-            print("Permissions set to 0777 to avoid readonly errors.")
-    except EntryNotFoundError:
-        print(f"Database file {DB_FILENAME} not found in the dataset. A new one will be created in /tmp/.")
     except Exception as e:
         print(f"Error downloading DB from Hugging Face: {e}")
-
-def upload_db():
-    """Uploads the writable /tmp/credentials.db to Hugging Face Dataset."""
-    if not HF_TOKEN:
-        print("WARNING: HF_TOKEN not set. Skipping cloud database upload.")
         return
 
-    if not os.path.exists(DB_PATH):
-        print(f"Error: {DB_PATH} does not exist locally to upload.")
-        return
+    for filename in SYNCED_FILENAMES:
+        local_path = f"{DATA_DIR}/{filename}"
+        if not os.path.exists(local_path):
+            print(f"File {filename} not found in the dataset. A new one will be created in {DATA_DIR}.")
+            continue
+        print(f"Successfully downloaded {filename} to {local_path}")
+        # Force file to be writable by the current process
+        os.chmod(local_path, stat.S_IRWXU | stat.S_IRWXG | stat.S_IRWXO)
+        print("Permissions set to 0777 to avoid readonly errors.")
+
+def stage_file(src_path: str) -> None:
+    """Copies a file into SYNC_DIR, keeping its mtime, unless the staged copy is already current."""
+    staged_path = os.path.join(SYNC_DIR, os.path.basename(src_path))
+    src_stat = os.stat(src_path)
+    try:
+        staged_stat = os.stat(staged_path)
+        if (staged_stat.st_mtime_ns, staged_stat.st_size) == (src_stat.st_mtime_ns, src_stat.st_size):
+            return
+    except FileNotFoundError:
+        pass
+    shutil.copy2(src_path, staged_path + ".tmp")
+    os.replace(staged_path + ".tmp", staged_path)
+
+def _db_signature():
+    """Changes whenever a write lands in the DB file or its WAL; an empty WAL is ignored."""
+    signature = []
+    for path in (DB_PATH, DB_PATH + "-wal"):
+        try:
+            file_stat = os.stat(path)
+        except FileNotFoundError:
+            signature.append(None)
+            continue
+        signature.append((file_stat.st_mtime_ns, file_stat.st_size) if file_stat.st_size else None)
+    return tuple(signature)
 
+class SQLiteCommitScheduler(CommitScheduler):
+    """
+    CommitScheduler for files that are rewritten in place rather than appended to.
+    The parent reads files after releasing its lock, so each push first stages a
+    consistent copy of every synced file in SYNC_DIR and uploads that copy.
+    History is squashed only after pushes that actually committed.
+    """
+
+    def __init__(self, *, stage_hooks=(), **kwargs):
+        self._stage_hooks = list(stage_hooks)
+        self._stage_lock = threading.Lock()
+        self._db_signature = None
+        # The scheduler pushes as soon as it starts; holding the lock makes that push wait for the seeding
+        with self._stage_lock:
+            super().__init__(**kwargs)
+            self._seed_downloaded_files()
+
+    def _seed_downloaded_files(self) -> None:
+        # Nothing has opened the DB yet, so plain copies of the downloaded files are consistent
+        for filename in SYNCED_FILENAMES:
+            local_path = os.path.join(DATA_DIR, filename)
+            if os.path.exists(local_path):
+                stage_file(local_path)
+        self._db_signature = _db_signature()
+        # These files were just fetched from the dataset; don't commit them straight back
+        for filename in SYNCED_FILENAMES:
+            staged_path = self.folder_path / filename
+            if staged_path.exists():
+                self.last_uploaded[staged_path] = staged_path.stat().st_mtime
+
+    def _stage_db(self) -> None:
+        if not os.path.exists(DB_PATH):
+            return
+        signature = _db_signature()
+        if signature == self._db_signature:
+            return
+        staged_path = os.path.join(SYNC_DIR, DB_FILENAME)
+        if os.path.exists(staged_path + ".tmp"):
+            os.remove(staged_path + ".tmp")
+        # The backup API copies a consistent snapshot, including writes still sitting in the WAL
+        with closing(sqlite3.connect(DB_PATH, timeout=30)) as source, \
+                closing(sqlite3.connect(staged_path + ".tmp")) as target:
+            source.backup(target)
+        os.replace(staged_path + ".tmp", staged_path)
+        self._db_signature = signature
+
+    def push_to_hub(self):
+        with self._stage_lock:
+            self._stage_db()
+            for stage in self._stage_hooks:
+                stage()
+            commit_info = super().push_to_hub()
+        if commit_info is not None:
+            print("Database successfully uploaded to Hugging Face!")
+            self.api.super_squash_history(repo_id=self.repo_id, repo_type=self.repo_type, branch=self.revision)
+        return commit_info
+
+def start_db_sync(stage_hooks=()):
+    """
+    Starts pushing changed synced files to the HF Dataset in the background; call right after
+    download_db, before anything opens the DB. stage_hooks copy other synced files into SYNC_DIR.
+    """
+    global commit_scheduler
+    if not HF_TOKEN:
+        print("WARNING: HF_TOKEN not set. Skipping cloud database sync.")
+        return
     try:
-        api = HfApi(token=HF_TOKEN)
-        print(f"Uploading {DB_PATH} to dataset {HF_DATASET_REPO}...")
-        api.upload_file(
-            path_or_fileobj=DB_PATH,
-            path_in_repo=DB_FILENAME,
+        commit_scheduler = SQLiteCommitScheduler(
             repo_id=HF_DATASET_REPO,
             repo_type="dataset",
-            commit_message="Update social credentials via backend"
+            folder_path=SYNC_DIR,
+            every=HF_SYNC_EVERY_MINUTES,
+            token=HF_TOKEN,
+            allow_patterns=list(SYNCED_FILENAMES),
+            stage_hooks=stage_hooks
         )
-        print("Database successfully uploaded to Hugging Face!")
     except Exception as e:
-        print(f"Error uploading DB to Hugging Face: {e}")
+        print(f"Error starting Hugging Face sync: {e}")
 
-def get_db():
-    db = SessionLocal()
+def stop_db_sync():
+    """Pushes any pending changes one last time and stops the background sync."""
+    if commit_scheduler is None:
+        return
+    # Stopping first keeps the scheduler's own exit hook from pushing a second time
+    commit_scheduler.stop()
     try:
+        commit_scheduler.push_to_hub()
+    except Exception as e:
+        print(f"Error uploading DB to Hugging Face: {e}")
+
+async def migrate_legacy_secrets() -> int:
+    """Re-encrypts any Fernet-encrypted credentials with AES-GCM. Returns the number of rows updated."""
+    migrated = 0
+    async with SessionLocal() as db:
+        for creds in await db.scalars(select(SocialCreds)):
+            changed = False
+            for column in ENCRYPTED_COLUMNS:
+                value = getattr(creds, column)
+                if not value or _aes_decrypt(value) is not None:
+                    continue
+                try:
+                    plain_bytes = cipher_suite.decrypt(value.encode('utf-8'))
+                except InvalidToken:
+                    print(f"Could not decrypt {column} for user {creds.user_id}; leaving it unchanged.")
+                    continue
+                setattr(creds, column, encrypt_secret(plain_bytes))
+                changed = True
+            if changed:
+                migrated += 1
+        if migrated:
+            await db.commit()
+            _creds_cache.clear()
+            print(f"Migrated credentials for {migrated} user(s) from Fernet to AES-GCM.")
+    return migrated
+
+# Credential rows cached per user so steady-state publishes skip the DB; invalidated on writes
+_creds_cache = LRUCache(maxsize=1024)
+
+async def get_user_creds(user_id: str):
+    """Returns the SocialCreds row for a user (detached; treat as read-only), or None."""
+    creds = _creds_cache.get(user_id)
+    if creds is None:
+        async with SessionLocal() as db:
+            creds = await db.scalar(select(SocialCreds).where(SocialCreds.user_id == user_id))
+        if creds is not None:
+            _creds_cache[user_id] = creds
+    return creds
+
+def invalidate_user_creds(user_id: str) -> None:
+    _creds_cache.pop(user_id, None)
+
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
\ No newline at end of file
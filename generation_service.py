@@ -1,31 +1,44 @@
 import os
-import json
 import re
+import time
+import asyncio
+import hashlib
+from collections import Counter
+from contextlib import aclosing
+from typing import AsyncIterator
+import faiss
+import numpy as np
+import httpx
+import orjson
+from cachetools import TTLCache
 from langchain_core.prompts import PromptTemplate
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.output_parsers import StrOutputParser
-from newsapi import NewsApiClient
+from langchain_core.messages import SystemMessage, HumanMessage
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 NEWS_API_KEY = os.getenv("NEWS_API_KEY")
 
+# Patterns compiled once at import instead of on every request
+_JSON_ARRAY_RE = re.compile(r'\[.*\]', re.DOTALL)
+_KEYWORD_RE = re.compile(r"\w{4,}")
+
+GEMINI_MODEL = "gemini-2.5-flash"
+
 # Stable LLM with low temperature and top_p – remains unchanged
 llm = ChatGoogleGenerativeAI(
-    model="gemini-2.5-flash",
+    model=GEMINI_MODEL,
     google_api_key=GEMINI_API_KEY,
     temperature=0.2,
     top_p=0.1
 )
 
-# Strict prompt (unchanged)
-STRICT_PROMPT = PromptTemplate.from_template(
-    """You are an elite, highly logical Social Media Ghostwriter and Strategist.
-Your objective is to generate EXACTLY 5 distinct, high-quality social media posts based ONLY on the provided inputs.
-INPUT DATA:
-- Target Platform: {platform}
-- Target Tone: {tone}
-- Context (User's profile, bio, and past posts): {context}
-- Voice Transcript (The core topic/idea): {transcript}
+# Static system instruction – identical on every call, so it is placed first where
+# Gemini's implicit prefix caching can reuse it; only REQUEST_PROMPT varies per request.
+SYSTEM_INSTRUCTION = """You are an elite, highly logical Social Media Ghostwriter and Strategist.
+Your objective is to generate EXACTLY 5 distinct, high-quality social media posts for each REQUEST, based ONLY on the provided inputs.
+The user message contains one or more numbered REQUEST blocks, each with its own Target Platform, Target Tone, Context and Voice Transcript.
+Handle each REQUEST independently and never use the inputs of one REQUEST in the posts of another.
 CRITICAL ANTI-HALLUCINATION INVARIANTS:
 1. ZERO FABRICATION: You are strictly forbidden from inventing numbers, job titles, companies, names, or personal anecdotes. Extract facts EXCLUSIVELY from the Context or Transcript.
 2. THE GHOSTWRITING RULE: Analyze the 'Context' to identify the user's profession and natural writing style. Adopt their vocabulary and sentence structure perfectly.
@@ -39,82 +52,456 @@ FORMATTING REQUIREMENTS:
 - Integrate 1-2 appropriate emojis naturally (!, ?, 🚀, 💡, 🔥, 🌍).
 - Do not include any introductory or concluding conversational text.
 STRICT OUTPUT FORMAT (API REQUIREMENT):
-You must return ONLY a valid JSON array containing exactly 5 objects. Each object must have a single key named "text".
+You must return ONLY a valid JSON array with exactly one entry per REQUEST, in REQUEST order. Each entry is an array containing exactly 5 objects. Each object must have a single key named "text".
 CRITICAL: Do NOT wrap the JSON in markdown blocks (e.g., no ```json). Return the raw, parseable bracket structure directly.
 [
-  {{"text": "<First engaging post here>"}},
-  {{"text": "<Second engaging post here>"}},
-  {{"text": "<Third engaging post here>"}},
-  {{"text": "<Fourth engaging post here>"}},
-  {{"text": "<Fifth engaging post here>"}}
+  [
+    {"text": "<First engaging post for REQUEST 1>"},
+    {"text": "<Second engaging post for REQUEST 1>"},
+    {"text": "<Third engaging post for REQUEST 1>"},
+    {"text": "<Fourth engaging post for REQUEST 1>"},
+    {"text": "<Fifth engaging post for REQUEST 1>"}
+  ]
 ]
 """
+
+REQUEST_PROMPT = PromptTemplate.from_template(
+    """INPUT DATA:
+- Target Platform: {platform}
+- Target Tone: {tone}
+- Context (User's profile, bio, and past posts): {context}
+- Voice Transcript (The core topic/idea): {transcript}
+"""
 )
 
+# Shared NewsAPI client so TLS connections are reused across requests
+_news_client = httpx.AsyncClient(
+    base_url="https://newsapi.org/v2/",
+    headers={"X-Api-Key": NEWS_API_KEY} if NEWS_API_KEY else None,
+    http2=True,
+    timeout=5.0
+)
+
+# NewsAPI results keyed by normalized keywords; 15 minutes matches NewsAPI freshness
+_news_cache = TTLCache(maxsize=512, ttl=900)
+_news_failure_cache = TTLCache(maxsize=512, ttl=60)
+
+# Two-tier response cache: exact transcript matches, then near-duplicate transcripts
+RESPONSE_CACHE_TTL = 3600  # seconds
+RESPONSE_CACHE_SIZE = 256
+SEMANTIC_CACHE_THRESHOLD = 0.95  # cosine similarity
+
+_FALLBACK_VARIATIONS = [
+    {"text": f"AI generation fallback. Please try again. 🚀 #VoiceToPost #AI"}
+    for _ in range(5)
+]
+
+_exact_cache = TTLCache(maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+_semantic_index = None  # faiss.IndexFlatIP, built on first store
+_semantic_entries = []  # (bucket, embedding, variations, expires_at), aligned with _semantic_index
+_inflight_locks = {}
+
+async def fetch_news_context(transcript: str) -> str:
+    """
+    Fetches live headlines related to the transcript from NewsAPI over the
+    shared connection pool. Results are cached per normalized keyword query.
+    """
+    if not NEWS_API_KEY:
+        return ""
+    query = _news_query(transcript)
+    if not query:
+        return ""
+    cached = _news_cache.get(query)
+    if cached is None:
+        cached = _news_failure_cache.get(query)
+    if cached is not None:
+        return cached
+
+    try:
+        response = await _news_client.get("everything", params={
+            "q": query,
+            "language": "en",
+            "sortBy": "relevancy",
+            "pageSize": 3
+        })
+        response.raise_for_status()
+        headlines = orjson.loads(response.content)
+        news_context = ""
+        if headlines['status'] == 'ok' and headlines['totalResults'] > 0:
+            news_context = "\n\nRelevant Live News:\n" + "\n".join([f"- {a['title']}" for a in headlines['articles']])
+        _news_cache[query] = news_context
+        return news_context
+    except Exception as e:
+        print(f"NewsAPI Error: {e}")
+        # Negative-cache briefly so a failing API doesn't add latency to every request
+        _news_failure_cache[query] = ""
+        return ""
+
+def _news_query(transcript: str) -> str:
+    """Builds an order-independent keyword query so equivalent transcripts share a cache entry."""
+    keywords = _KEYWORD_RE.findall(transcript.lower())[:5]
+    return " ".join(sorted(set(keywords)))
+
+async def _await_news(transcript: str, news_task: asyncio.Future = None) -> str:
+    # Optional live news enrichment, only awaited once the response cache has missed
+    if news_task is None:
+        return await fetch_news_context(transcript)
+    return await news_task
+
 async def generate_post_rag(
     transcript: str,
     retrieved_context: list,
     tone: str,
     platform: str,
-    num_variations: int = 5
+    num_variations: int = 5,
+    news_task: asyncio.Future = None,
+    query_embedding: np.ndarray = None,
+    use_cache: bool = True,
+    user_id: str = None
 ) -> list:
+    """
+    Generates post variations, serving repeat and near-duplicate requests from
+    the response cache. Pass use_cache=False to force fresh variations (e.g. on
+    retry attempts), and query_embedding (normalized, shape (1, dim)) to enable
+    the semantic tier. Only requests from the same user_id are batched together.
+    news_task is a NewsAPI lookup the caller started early; it is only awaited on a miss.
+    """
     # Format the vector store results
     formatted_context = _format_context(retrieved_context)
 
-    # Optional live news enrichment
-    news_context = ""
-    if NEWS_API_KEY:
-        try:
-            newsapi = NewsApiClient(api_key=NEWS_API_KEY)
-            query = transcript[:50]
-            headlines = newsapi.get_everything(q=query, language='en', sort_by='relevancy', page_size=3)
-            if headlines['status'] == 'ok' and headlines['totalResults'] > 0:
-                news_context = "\n\nRelevant Live News:\n" + "\n".join([f"- {a['title']}" for a in headlines['articles']])
-        except Exception as e:
-            print(f"NewsAPI Error: {e}")
+    if not use_cache:
+        return await _generate_variations(transcript, formatted_context, tone, platform, news_task, user_id)
 
-    final_context = formatted_context + news_context
+    exact_key = _cache_key(tone, platform, formatted_context, transcript)
+    semantic_bucket = _cache_key(tone, platform, formatted_context)
+
+    # Single-flight: identical concurrent requests wait for the first one to fill the cache
+    lock = _inflight_locks.setdefault(exact_key, asyncio.Lock())
+    try:
+        async with lock:
+            cached = _cache_lookup(exact_key, semantic_bucket, query_embedding)
+            if cached is not None:
+                return [dict(post) for post in cached]
 
-    # Build chain
-    chain = STRICT_PROMPT | llm | StrOutputParser()
+            variations = await _generate_variations(transcript, formatted_context, tone, platform, news_task, user_id)
+            if variations is not _FALLBACK_VARIATIONS:
+                _cache_store(exact_key, semantic_bucket, query_embedding, variations)
+            return [dict(post) for post in variations]
+    finally:
+        if not lock.locked():
+            _inflight_locks.pop(exact_key, None)
+
+async def _generate_variations(
+    transcript: str,
+    formatted_context: str,
+    tone: str,
+    platform: str,
+    news_task: asyncio.Future = None,
+    user_id: str = None
+) -> list:
+    final_context = formatted_context + await _await_news(transcript, news_task)
 
     try:
-        raw_result = await chain.ainvoke({
-            "context": final_context,
-            "transcript": transcript,
-            "tone": tone,
-            "platform": platform
-        })
+        return await batcher.submit(REQUEST_PROMPT.format(
+            context=final_context,
+            transcript=transcript,
+            tone=tone,
+            platform=platform
+        ), batch_key=user_id)
+    except Exception as e:
+        print(f"RAG Parsing Error: {e}")
+        # Safe fallback (never cached)
+        return _FALLBACK_VARIATIONS
 
-        print(f"Raw LLM output: {raw_result[:500]}")  # Debug log
+async def stream_post_rag(
+    transcript: str,
+    retrieved_context: list,
+    tone: str,
+    platform: str,
+    news_task: asyncio.Future = None,
+    query_embedding: np.ndarray = None,
+    use_cache: bool = True
+) -> AsyncIterator[dict]:
+    """
+    Streaming variant of generate_post_rag: yields each post as soon as Gemini
+    finishes writing it. Cache hits are replayed immediately. Streams bypass the
+    batcher, since one shared call cannot be streamed back to several callers.
+    """
+    formatted_context = _format_context(retrieved_context)
+    exact_key = _cache_key(tone, platform, formatted_context, transcript)
+    semantic_bucket = _cache_key(tone, platform, formatted_context)
 
-        # 🔥 Regex extraction – find the first JSON array
-        match = re.search(r'\[.*\]', raw_result, re.DOTALL)
-        if not match:
-            raise ValueError("No JSON array found in response")
+    if use_cache:
+        cached = _cache_lookup(exact_key, semantic_bucket, query_embedding)
+        if cached is not None:
+            for post in cached:
+                yield dict(post)
+            return
 
-        clean_json = match.group(0)
-        parsed = json.loads(clean_json)
+    news_context = await _await_news(transcript, news_task)
 
-        # Flexible array handling – accept any list, take first 5
-        if isinstance(parsed, list):
-            # 🔥 THE FIX: Convert literal \n strings into actual line breaks
-            for post in parsed:
-                if "text" in post:
-                    post["text"] = post["text"].replace("\\n", "\n")
-                    
-            return parsed[:5]   # Return up to 5 posts
-        else:
-            raise ValueError("Parsed JSON is not a list")
+    request_prompt = _format_batch([REQUEST_PROMPT.format(
+        context=formatted_context + news_context,
+        transcript=transcript,
+        tone=tone,
+        platform=platform
+    )])
 
+    posts = []
+    completed = False
+    try:
+        async with aclosing(_stream_posts(request_prompt)) as stream:
+            async for post in stream:
+                posts.append(post)
+                yield dict(post)
+                if len(posts) >= 5:
+                    break
+        completed = True
     except Exception as e:
-        print(f"RAG Parsing Error: {e}")
-        # Safe fallback
-        fallback = [
-            {"text": f"AI generation fallback. Please try again. 🚀 #VoiceToPost #AI"}
-            for _ in range(5)
-        ]
-        return fallback
+        print(f"RAG Streaming Error: {e}")
+
+    if not posts:
+        # Safe fallback (never cached)
+        for post in _FALLBACK_VARIATIONS:
+            yield dict(post)
+        return
+    # A stream cut short would pin a truncated set in the cache for the whole TTL
+    if use_cache and completed and len(posts) == 5:
+        _cache_store(exact_key, semantic_bucket, query_embedding, posts)
+
+# ==================== Request Batching ====================
+
+class GenerationBatcher:
+    """
+    Collects concurrent generation requests for a short window and sends them
+    to Gemini as a single call, resolving each caller with its own variations.
+    Batches never mix batch keys: a prompt carries its user's private context,
+    so it must not share a call with another user's untrusted transcript.
+    A request for an idle key is sent at once; a window only opens while that
+    key already has a call in flight.
+    """
+
+    def __init__(self, max_batch_size: int = 8, max_wait: float = 0.075):
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait
+        self._pending = {}  # batch_key -> requests collected in the current window
+        self._in_flight = Counter()  # batch_key -> calls currently waiting on Gemini
+        self._dispatches = set()
+
+    async def submit(self, request_prompt: str, batch_key: str = None) -> list:
+        """
+        Queues one request prompt and waits for its parsed list of posts. Only
+        requests with the same batch_key are sent together; None is never batched.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if batch_key is None or self.max_batch_size == 1 or (
+            batch_key not in self._pending and not self._in_flight[batch_key]
+        ):
+            self._start_dispatch(batch_key, [(request_prompt, future)])
+            return await future
+
+        batch = self._pending.get(batch_key)
+        if batch is None:
+            batch = self._pending[batch_key] = []
+            loop.call_later(self.max_wait, self._flush, batch_key, batch)
+        batch.append((request_prompt, future))
+        if len(batch) >= self.max_batch_size:
+            self._flush(batch_key, batch)
+        return await future
+
+    def _flush(self, batch_key: str, batch: list) -> None:
+        if self._pending.get(batch_key) is not batch:
+            return  # Already dispatched when it filled up
+        del self._pending[batch_key]
+        self._start_dispatch(batch_key, batch)
+
+    def _start_dispatch(self, batch_key: str, batch: list) -> None:
+        # Dispatch in the background so new requests start a fresh window immediately
+        self._in_flight[batch_key] += 1
+        task = asyncio.create_task(self._dispatch(batch_key, batch))
+        self._dispatches.add(task)
+        task.add_done_callback(self._dispatches.discard)
+
+    def _release(self, batch_key: str) -> None:
+        self._in_flight[batch_key] -= 1
+        if not self._in_flight[batch_key]:
+            del self._in_flight[batch_key]
+
+    async def _dispatch(self, batch_key: str, batch: list) -> None:
+        try:
+            try:
+                raw_result = await _invoke_llm(_format_batch([prompt for prompt, _ in batch]))
+                print(f"Raw LLM output ({len(batch)} requests): {raw_result[:500]}")  # Debug log
+                results = _parse_batch(raw_result, len(batch))
+            finally:
+                # Free the key before any caller resumes, so its next request goes out at once
+                self._release(batch_key)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue  # Caller went away
+            if result is None:
+                future.set_exception(ValueError("No variations returned for this request"))
+            else:
+                future.set_result(result)
+
+batcher = GenerationBatcher(
+    max_batch_size=int(os.getenv("GENERATION_BATCH_SIZE", "8")),
+    max_wait=float(os.getenv("GENERATION_BATCH_WINDOW_MS", "75")) / 1000
+)
+
+def _format_batch(request_prompts: list) -> str:
+    return "\n".join(
+        f"REQUEST {i}:\n{prompt}" for i, prompt in enumerate(request_prompts, start=1)
+    )
+
+def _parse_batch(raw_result: str, expected: int) -> list:
+    """Splits the model's array-of-arrays into one list of posts per request (None if missing)."""
+    # 🔥 Regex extraction – find the outermost JSON array
+    match = _JSON_ARRAY_RE.search(raw_result)
+    if not match:
+        raise ValueError("No JSON array found in response")
+
+    parsed = orjson.loads(match.group(0))
+    if not isinstance(parsed, list):
+        raise ValueError("Parsed JSON is not a list")
+
+    # A single request answered with a flat array of posts is still usable
+    if expected == 1 and parsed and all(isinstance(item, dict) for item in parsed):
+        parsed = [parsed]
+
+    results = []
+    for i in range(expected):
+        posts = parsed[i] if i < len(parsed) else None
+        if not isinstance(posts, list):
+            results.append(None)
+            continue
+        posts = [post for post in posts if isinstance(post, dict)]
+        # 🔥 THE FIX: Convert literal \n strings into actual line breaks
+        for post in posts:
+            if "text" in post:
+                post["text"] = post["text"].replace("\\n", "\n")
+        results.append(posts[:5])   # Up to 5 posts per request
+    return results
+
+async def _invoke_llm(request_prompt: str) -> str:
+    """Sends the (batched) request prompt to Gemini after the static system instruction."""
+    chain = llm | StrOutputParser()
+    return await chain.ainvoke([
+        SystemMessage(content=SYSTEM_INSTRUCTION),
+        HumanMessage(content=request_prompt)
+    ])
+
+async def _stream_posts(request_prompt: str) -> AsyncIterator[dict]:
+    """Streams Gemini's response and yields each post object once its closing brace arrives."""
+    async for post in _stream_objects(llm, [
+        SystemMessage(content=SYSTEM_INSTRUCTION),
+        HumanMessage(content=request_prompt)
+    ]):
+        yield post
+
+async def _stream_objects(model, messages: list) -> AsyncIterator[dict]:
+    scanner = _JsonObjectScanner()
+    async for chunk in (model | StrOutputParser()).astream(messages):
+        for raw_object in scanner.feed(chunk):
+            try:
+                post = orjson.loads(raw_object)
+            except orjson.JSONDecodeError:
+                continue
+            if isinstance(post, dict) and "text" in post:
+                # 🔥 THE FIX: Convert literal \n strings into actual line breaks
+                post["text"] = post["text"].replace("\\n", "\n")
+                yield post
+
+class _JsonObjectScanner:
+    """Incrementally extracts complete {...} objects from JSON text arriving in chunks."""
+
+    def __init__(self):
+        self._buffer = []
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, chunk: str) -> list:
+        objects = []
+        for char in chunk:
+            if self._depth > 0:
+                self._buffer.append(char)
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == "{":
+                if self._depth == 0:
+                    self._buffer = ["{"]
+                self._depth += 1
+            elif char == "}" and self._depth > 0:
+                self._depth -= 1
+                if self._depth == 0:
+                    objects.append("".join(self._buffer))
+        return objects
+
+# ==================== Response Cache ====================
+
+def _cache_key(*parts: str) -> str:
+    return hashlib.sha256(orjson.dumps(parts)).hexdigest()
+
+def _cache_lookup(exact_key: str, semantic_bucket: str, query_embedding: np.ndarray = None):
+    cached = _exact_cache.get(exact_key)
+    if cached is None and query_embedding is not None:
+        cached = _semantic_lookup(semantic_bucket, query_embedding)
+    if cached is not None:
+        print("Response cache hit")
+    return cached
+
+def _cache_store(exact_key: str, semantic_bucket: str, query_embedding: np.ndarray, variations: list) -> None:
+    _exact_cache[exact_key] = variations
+    if query_embedding is not None:
+        _semantic_store(semantic_bucket, query_embedding, variations)
+
+def _semantic_lookup(bucket: str, query_embedding: np.ndarray):
+    """Returns cached variations for a near-duplicate transcript in the same bucket, if any."""
+    if _semantic_index is None or _semantic_index.ntotal == 0:
+        return None
+    k = min(10, _semantic_index.ntotal)
+    scores, indices = _semantic_index.search(query_embedding, k)
+    now = time.monotonic()
+    for score, idx in zip(scores[0], indices[0]):
+        # Results are sorted by similarity, so stop at the first one below threshold
+        if idx == -1 or score < SEMANTIC_CACHE_THRESHOLD:
+            break
+        entry_bucket, _, variations, expires_at = _semantic_entries[idx]
+        if entry_bucket == bucket and expires_at > now:
+            return variations
+    return None
+
+def _semantic_store(bucket: str, query_embedding: np.ndarray, variations: list) -> None:
+    global _semantic_index, _semantic_entries
+    now = time.monotonic()
+    if _semantic_index is None or len(_semantic_entries) >= RESPONSE_CACHE_SIZE:
+        # IndexFlatIP has no cheap removal, so rebuild it from the newest live entries
+        live = [e for e in _semantic_entries if e[3] > now][-(RESPONSE_CACHE_SIZE // 2):]
+        _semantic_index = faiss.IndexFlatIP(query_embedding.shape[1])
+        for _, embedding, _, _ in live:
+            _semantic_index.add(embedding)
+        _semantic_entries = live
+    _semantic_index.add(query_embedding)
+    _semantic_entries.append((bucket, query_embedding, variations, now + RESPONSE_CACHE_TTL))
+
+async def close() -> None:
+    """Closes the shared HTTP clients; called on application shutdown."""
+    await _news_client.aclose()
 
 def _format_context(vector_results: list) -> str:
     if not vector_results:
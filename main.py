@@ -1,18 +1,20 @@
 import os
+import json
 import httpx
 import asyncio
-from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Form
-from fastapi.responses import RedirectResponse, HTMLResponse, JSONResponse
+from collections import Counter
+from contextlib import aclosing
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Form, Request
+from fastapi.responses import RedirectResponse, HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from apscheduler.schedulers.background import BackgroundScheduler
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 import tweepy
 from dotenv import load_dotenv
 from typing import Optional
 from datetime import datetime
 from pydantic import BaseModel
-import dateparser
-from dateparser.search import search_dates
 
 import PyPDF2
 import io
@@ -20,13 +22,18 @@ import vector_store
 import speech_service
 import generation_service
 import scoring
-from database import get_db, SessionLocal, SocialCreds, encrypt_secret, decrypt_secret, download_db, upload_db
+from database import (
+    get_db, init_db, get_user_creds, invalidate_user_creds, SocialCreds, encrypt_secret,
+    download_db, start_db_sync, stop_db_sync, migrate_legacy_secrets
+)
 import social_publisher
 
 load_dotenv()
 
 app = FastAPI(title="Voice-To-Post Backend API")
-scheduler = BackgroundScheduler()
+# Runs scheduled jobs as coroutines on the app's event loop; apscheduler is only imported when enabled
+ENABLE_SCHEDULER = os.getenv("ENABLE_SCHEDULER", "true").lower() in ("1", "true", "yes")
+scheduler = None
 
 # OAuth App credentials
 LINKEDIN_CLIENT_ID = os.getenv("LINKEDIN_CLIENT_ID")
@@ -38,6 +45,28 @@ BASE_URL = os.getenv("BASE_URL", "http://localhost:7860")
 # In‑memory store for PKCE verifier
 twitter_oauth_state = {}
 
+# Reject oversized voice notes before their body is spooled to disk
+MAX_AUDIO_UPLOAD_BYTES = int(os.getenv("MAX_AUDIO_UPLOAD_BYTES", str(5 * 1024 * 1024)))
+AUDIO_UPLOAD_PATHS = {"/generate-post", "/parse-schedule"}
+
+# Fast-path rejection of inputs that would only burn a Gemini call.
+# The distance ceiling is disabled unless set: scoring treats distances above 1.2 as a new topic.
+MIN_TRANSCRIPT_WORDS = int(os.getenv("MIN_TRANSCRIPT_WORDS", "4"))
+CONTEXT_DISTANCE_CEILING = float(os.getenv("CONTEXT_DISTANCE_CEILING", "inf"))
+fast_path_rejections = Counter()
+
+# dateparser settings built once; pinning the language skips per-call language detection
+DATEPARSER_SETTINGS = {'TIMEZONE': 'Asia/Kolkata', 'RETURN_AS_TIMEZONE_AWARE': True}
+DATEPARSER_LANGUAGES = ['en']
+
+# Keeps references to fire-and-forget startup tasks so they aren't garbage collected
+warmup_tasks = set()
+
+# The vector store only marks itself dirty on insert; this loop writes it to disk,
+# independent of the HF sync, so a crash loses at most one interval of inserts
+INDEX_PERSIST_INTERVAL_SECONDS = float(os.getenv("INDEX_PERSIST_INTERVAL_SECONDS", "30"))
+index_persist_task = None
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -46,18 +75,121 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+class _UploadTooLarge(Exception):
+    pass
+
+class AudioUploadLimitMiddleware:
+    """
+    Answers 413 for audio uploads over MAX_AUDIO_UPLOAD_BYTES. Content-Length is checked up front,
+    and body bytes are counted as they arrive so chunked uploads are capped too.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in AUDIO_UPLOAD_PATHS:
+            await self.app(scope, receive, send)
+            return
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > MAX_AUDIO_UPLOAD_BYTES:
+            await self._reject(scope, receive, send)
+            return
+
+        received = 0
+        too_large = False
+
+        async def limited_receive():
+            nonlocal received, too_large
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > MAX_AUDIO_UPLOAD_BYTES:
+                    too_large = True
+                    raise _UploadTooLarge()
+            return message
+
+        async def guarded_send(message):
+            # The app's own answer to the aborted body (FastAPI turns it into a 400) is replaced below
+            if not too_large:
+                await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except _UploadTooLarge:
+            pass
+        if too_large:
+            await self._reject(scope, receive, send)
+
+    async def _reject(self, scope, receive, send):
+        response = JSONResponse(
+            status_code=413,
+            content={"detail": f"Audio upload exceeds the {MAX_AUDIO_UPLOAD_BYTES // (1024 * 1024)} MB limit."}
+        )
+        await response(scope, receive, send)
+
+app.add_middleware(AudioUploadLimitMiddleware)
+
 @app.on_event("startup")
 async def startup_event():
+    global scheduler, index_persist_task
+    # Size the pool used by asyncio.to_thread for embedding, FAISS and other blocking work
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4))
+    )
     download_db()
-    scheduler.start()
+    # Changed files are pushed to the dataset in the background, so writes never wait on an upload
+    start_db_sync(stage_hooks=[vector_store.stage_index_files])
+    await init_db()
+    await migrate_legacy_secrets()
+    await asyncio.to_thread(vector_store.load_index)
+    if ENABLE_SCHEDULER:
+        from apscheduler.schedulers.asyncio import AsyncIOScheduler
+        scheduler = AsyncIOScheduler()
+        scheduler.start()
+    # Pay the embedding model's and dateparser's first-call cost before the first request does
+    for warmup in (vector_store.warmup, _warmup_dateparser):
+        task = asyncio.create_task(asyncio.to_thread(warmup))
+        warmup_tasks.add(task)
+        task.add_done_callback(warmup_tasks.discard)
+    index_persist_task = asyncio.create_task(index_persist_worker())
     # Optional global sample data
     sample_data = [
         "Welcome to Voice-To-Post backend!",
         "Vector databases help in doing semantic similarity search.",
         "FastAPI is a fast, highly performant web framework for building APIs."
     ]
-    vector_store.add_text_to_index(sample_data, user_id="system")
-    print("Application initialized. Loaded sample data into the vector store.")
+    # Only seed a fresh index; a persisted one already contains the sample data
+    if vector_store.index.ntotal == 0:
+        batch_size = vector_store.EMBEDDING_BATCH_SIZE
+        await asyncio.gather(*[
+            asyncio.to_thread(vector_store.add_text_to_index, sample_data[i:i + batch_size], user_id="system")
+            for i in range(0, len(sample_data), batch_size)
+        ])
+        print("Application initialized. Loaded sample data into the vector store.")
+    else:
+        print("Application initialized. Using the persisted vector store.")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if scheduler:
+        scheduler.shutdown(wait=False)
+    if index_persist_task:
+        index_persist_task.cancel()
+    # Write out the vector store, then flush any change made since the last scheduled push
+    await asyncio.to_thread(vector_store.persist_index)
+    await asyncio.to_thread(stop_db_sync)
+    await asyncio.gather(generation_service.close(), speech_service.close())
+
+async def index_persist_worker():
+    while True:
+        await asyncio.sleep(INDEX_PERSIST_INTERVAL_SECONDS)
+        # No-op unless something was inserted since the last write
+        await asyncio.to_thread(vector_store.persist_index)
+
+async def add_to_memory(text_list: list, user_id: str):
+    """Adds texts to the vector store off the event loop; it is persisted and shipped with the next scheduled push."""
+    await asyncio.to_thread(vector_store.add_text_to_index, text_list, user_id=user_id)
 
 @app.get("/")
 async def health_endpoint():
@@ -65,25 +197,26 @@ async def health_endpoint():
 
 # ==================== Bio Syncing Helpers ====================
 
-async def sync_twitter_data(user_id: str, access_token: str, db: Session):
+async def sync_twitter_data(user_id: str, access_token: str, db: AsyncSession):
     try:
         client = tweepy.Client(bearer_token=access_token)
         me = client.get_me(user_fields=["description"])
         if me.data:
             description = me.data.description
-            creds = db.query(SocialCreds).filter(SocialCreds.user_id == user_id).first()
+            creds = await db.scalar(select(SocialCreds).where(SocialCreds.user_id == user_id))
             if not creds:
                 creds = SocialCreds(user_id=user_id)
                 db.add(creds)
             creds.twitter_bio = description
-            db.commit()
+            await db.commit()
+            invalidate_user_creds(user_id)
             if description:
-                vector_store.add_text_to_index([description], user_id=user_id)
+                await add_to_memory([description], user_id=user_id)
                 print(f"Synced Twitter bio for user {user_id}")
     except Exception as e:
         print(f"Error syncing Twitter data: {e}")
 
-async def sync_linkedin_data(user_id: str, access_token: str, db: Session):
+async def sync_linkedin_data(user_id: str, access_token: str, db: AsyncSession):
     headers = {"Authorization": f"Bearer {access_token}"}
     async with httpx.AsyncClient() as client:
         resp = await client.get("https://api.linkedin.com/v2/userinfo", headers=headers)
@@ -93,14 +226,15 @@ async def sync_linkedin_data(user_id: str, access_token: str, db: Session):
         data = resp.json()
         name = data.get("name", "")
         bio = name or data.get("email", data.get("sub", ""))
-        creds = db.query(SocialCreds).filter(SocialCreds.user_id == user_id).first()
+        creds = await db.scalar(select(SocialCreds).where(SocialCreds.user_id == user_id))
         if not creds:
             creds = SocialCreds(user_id=user_id)
             db.add(creds)
         creds.linkedin_headline = bio
-        db.commit()
+        await db.commit()
+        invalidate_user_creds(user_id)
         if bio:
-            vector_store.add_text_to_index([bio], user_id=user_id)
+            await add_to_memory([bio], user_id=user_id)
             print(f"Synced LinkedIn bio for user {user_id}")
 
 # ==================== OAuth Endpoints ====================
@@ -120,7 +254,7 @@ async def linkedin_login():
     return RedirectResponse(auth_url)
 
 @app.get("/auth/linkedin/callback")
-async def linkedin_callback(code: str, db: Session = Depends(get_db)):
+async def linkedin_callback(code: str, db: AsyncSession = Depends(get_db)):
     clean_base = BASE_URL.rstrip('/')
     redirect_uri = f"{clean_base}/auth/linkedin/callback"
     token_url = "https://www.linkedin.com/oauth/v2/accessToken"
@@ -147,13 +281,13 @@ async def linkedin_callback(code: str, db: Session = Depends(get_db)):
         userinfo_data = userinfo.json()
         user_id = userinfo_data["sub"]
 
-    creds = db.query(SocialCreds).filter(SocialCreds.user_id == user_id).first()
+    creds = await db.scalar(select(SocialCreds).where(SocialCreds.user_id == user_id))
     if not creds:
         creds = SocialCreds(user_id=user_id)
         db.add(creds)
     creds.linkedin_access_token = encrypt_secret(access_token)
-    db.commit()
-    upload_db()
+    await db.commit()
+    invalidate_user_creds(user_id)
 
     await sync_linkedin_data(user_id, access_token, db)
 
@@ -183,7 +317,7 @@ async def twitter_login():
     return RedirectResponse(authorization_url)
 
 @app.get("/auth/twitter/callback")
-async def twitter_callback(code: str, state: str, db: Session = Depends(get_db)):
+async def twitter_callback(code: str, state: str, db: AsyncSession = Depends(get_db)):
     stored = twitter_oauth_state.pop(state, None)
     if not stored:
         raise HTTPException(status_code=400, detail="Invalid state parameter")
@@ -209,15 +343,15 @@ async def twitter_callback(code: str, state: str, db: Session = Depends(get_db))
         raise HTTPException(status_code=400, detail="Could not fetch Twitter user info")
     user_id = str(me.data.id)
 
-    creds = db.query(SocialCreds).filter(SocialCreds.user_id == user_id).first()
+    creds = await db.scalar(select(SocialCreds).where(SocialCreds.user_id == user_id))
     if not creds:
         creds = SocialCreds(user_id=user_id)
         db.add(creds)
     creds.twitter_access_token = encrypt_secret(access_token)
     if refresh_token:
         creds.twitter_refresh_token = encrypt_secret(refresh_token)
-    db.commit()
-    upload_db()
+    await db.commit()
+    invalidate_user_creds(user_id)
 
     await sync_twitter_data(user_id, access_token, db)
 
@@ -235,69 +369,137 @@ async def twitter_callback(code: str, state: str, db: Session = Depends(get_db))
     """)
 
 # ==================== Generation Endpoint ====================
+def _retrieve_context(transcript: str, user_id: str):
+    """Embeds the transcript once and reuses it for the vector search and the response cache."""
+    query_embedding = vector_store.embed_query(transcript)
+    results = vector_store.search_index(transcript, top_k=5, user_id=user_id, query_embedding=query_embedding)
+    return query_embedding, results
+
 @app.post("/generate-post")
 async def generate_post(
+    request: Request,
     audio_file: UploadFile = File(...),
     tone: str = Form(...),
     platform: str = Form(...),
     user_id: str = Form(...)
 ):
     # 1. Transcribe
-    audio_bytes = await audio_file.read()
-    transcript = await speech_service.transcribe_audio_bytes(audio_bytes, audio_file.content_type)
+    transcript = await speech_service.transcribe_audio_stream(audio_file)
     if transcript.startswith("Error") or transcript.startswith("ERROR"):
         raise HTTPException(status_code=500, detail=transcript)
+    if len(transcript.split()) < MIN_TRANSCRIPT_WORDS:
+        return _fast_path_reject(request, "short_transcript", "Transcript is too short to generate a post.")
 
-    # 2. Retrieve private context (filtered by user_id)
-    results = vector_store.search_index(transcript, top_k=5, user_id=user_id)
+    # 2. Retrieve private context (filtered by user_id) while live news loads concurrently;
+    # the news is only awaited on a response-cache miss and cancelled otherwise
+    news_task = asyncio.create_task(generation_service.fetch_news_context(transcript))
+    try:
+        query_embedding, results = await asyncio.to_thread(_retrieve_context, transcript, user_id)
+    except BaseException:
+        news_task.cancel()
+        raise
     avg_distance = (
         sum([res["distance"] for res in results]) / len(results)
         if results else -1.0
     )
     raw_context_text = " ".join([res["text"] for res in results]) if results else ""
-
-    # 3. Production loop: collect exactly 5 posts passing threshold 0.45, max 15 attempts
+    if avg_distance > CONTEXT_DISTANCE_CEILING:
+        news_task.cancel()
+        return _fast_path_reject(request, "low_context", "No relevant context found for this transcript.")
+
+    # 3. Clients asking for text/event-stream get each approved post as soon as it is scored
+    stream = "text/event-stream" in request.headers.get("accept", "")
+    events = _generate_scored_posts(
+        transcript, results, tone, platform, user_id, news_task, query_embedding,
+        avg_distance, raw_context_text, stream=stream
+    )
+    if stream:
+        return StreamingResponse(
+            _sse_frames(events),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+    async for event, data in events:
+        if event == "done":
+            return data
+
+def _fast_path_reject(request: Request, reason: str, message: str):
+    """Answers without calling Gemini, in whichever format the client asked for."""
+    fast_path_rejections[reason] += 1
+    print(f"Fast-path rejection ({reason}); totals: {dict(fast_path_rejections)}")
+    summary = {
+        "status": "rejected",
+        "variations": [],
+        "total_generated": 0,
+        "attempts_used": 0,
+        "message": message
+    }
+    if "text/event-stream" in request.headers.get("accept", ""):
+        async def events():
+            yield "done", summary
+        return StreamingResponse(_sse_frames(events()), media_type="text/event-stream")
+    return summary
+
+async def _generate_scored_posts(
+    transcript, results, tone, platform, user_id, news_task, query_embedding,
+    avg_distance, raw_context_text, stream=False
+):
+    """
+    Production loop: collect exactly 5 posts passing the threshold, max 15 attempts.
+    Yields ("variation", post) for every approved post, then ("done", summary).
+    """
     MAX_ATTEMPTS = 15
     THRESHOLD = 0.75
     attempts = 0
     approved_posts = []
     all_scored = []
 
-    while len(approved_posts) < 5 and attempts < MAX_ATTEMPTS:
-        attempts += 1
-        generated_variations = await generation_service.generate_post_rag(
-            transcript,
-            results,
-            tone=tone,
-            platform=platform,
-            num_variations=5
-        )
-
-        for post in generated_variations:
-            if "text" not in post:
-                continue
-            score_data = scoring.calculate_safety_score(
-                generated_post=post["text"],
-                context_distance=avg_distance,
-                context_text=raw_context_text
+    try:
+        while len(approved_posts) < 5 and attempts < MAX_ATTEMPTS:
+            attempts += 1
+            variations = _iter_variations(
+                stream,
+                transcript,
+                results,
+                user_id,
+                tone=tone,
+                platform=platform,
+                news_task=news_task,
+                query_embedding=query_embedding,
+                # Retries need fresh variations, so only the first attempt may be served from cache
+                use_cache=(attempts == 1)
             )
-            final_score = score_data["final_score"]
-            all_scored.append({
-                "text": post["text"],
-                "score": final_score,
-                "breakdown": score_data["breakdown"]
-            })
-            if final_score >= THRESHOLD:
-                approved_posts.append({
-                    "text": post["text"],
-                    "score": final_score
-                })
-                if len(approved_posts) >= 5:
-                    break
+            async with aclosing(variations):
+                async for post in variations:
+                    if "text" not in post:
+                        continue
+                    score_data = scoring.calculate_safety_score(
+                        generated_post=post["text"],
+                        context_distance=avg_distance,
+                        context_text=raw_context_text
+                    )
+                    final_score = score_data["final_score"]
+                    all_scored.append({
+                        "text": post["text"],
+                        "score": final_score,
+                        "breakdown": score_data["breakdown"]
+                    })
+                    if final_score >= THRESHOLD:
+                        approved = {
+                            "text": post["text"],
+                            "score": final_score
+                        }
+                        approved_posts.append(approved)
+                        yield "variation", approved
+                        if len(approved_posts) >= 5:
+                            break
+    finally:
+        # Cache hits never await the news lookup; don't leave it running
+        news_task.cancel()
 
     approved_posts.sort(key=lambda x: x["score"], reverse=True)
     status = "success" if len(approved_posts) >= 5 else "partial_success"
-    return {
+    yield "done", {
         "status": status,
         "variations": approved_posts[:5],
         "total_generated": len(all_scored),
@@ -305,20 +507,33 @@ async def generate_post(
         "message": f"Generated {len(approved_posts)} posts meeting threshold." if len(approved_posts) < 5 else None
     }
 
+async def _iter_variations(stream: bool, transcript: str, results: list, user_id: str, **kwargs):
+    if stream:
+        async for post in generation_service.stream_post_rag(transcript, results, **kwargs):
+            yield post
+    else:
+        for post in await generation_service.generate_post_rag(
+            transcript, results, num_variations=5, user_id=user_id, **kwargs
+        ):
+            yield post
+
+async def _sse_frames(events):
+    async for event, data in events:
+        yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
 # ==================== Publish Post ====================
 @app.post("/publish-post")
 async def publish_post(
     platform: str = Form(...),
     post_text: str = Form(...),
-    user_id: str = Form(...),
-    db: Session = Depends(get_db)
+    user_id: str = Form(...)
 ):
     # 1. Catch literal \n characters from Swagger copy-pasting and turn them into real line breaks
     post_text = post_text.replace("\\n", "\n")
 
     # 2. Proceed with publishing
     platform_key = platform.lower()
-    creds = db.query(SocialCreds).filter(SocialCreds.user_id == user_id).first()
+    creds = await get_user_creds(user_id)
     if not creds:
         raise HTTPException(status_code=404, detail=f"No credentials found for user {user_id}.")
     result = await social_publisher.publish_to_platform(platform_key, post_text, creds)
@@ -326,7 +541,7 @@ async def publish_post(
     # 3. Save the published post to the AI's memory (vector store)
     if result and result.get("status") == "success":
         memory_text = f"[{platform_key.capitalize()} Post History]: {post_text}"
-        vector_store.add_text_to_index([memory_text], user_id=user_id)
+        await add_to_memory([memory_text], user_id=user_id)
 
     return result
 
@@ -359,7 +574,7 @@ async def upload_policy(
 
         # Format as a strict rule and push to the Vector Database
         memory_text = f"[STRICT BRAND POLICY/GUIDELINE]: {extracted_text}"
-        vector_store.add_text_to_index([memory_text], user_id=user_id)
+        await add_to_memory([memory_text], user_id=user_id)
 
         return {
             "status": "success",
@@ -375,16 +590,12 @@ async def upload_policy(
 
 @app.post("/parse-schedule")
 async def parse_schedule(audio_file: UploadFile = File(...)):
-    audio_bytes = await audio_file.read()
-    transcript = await speech_service.transcribe_audio_bytes(audio_bytes, audio_file.content_type)
+    transcript = await speech_service.transcribe_audio_stream(audio_file)
 
     print(f"DEBUG - Scheduling Audio Transcript: '{transcript}'")
 
     # Use search_dates to extract the time from natural language
-    found_dates = search_dates(
-        transcript,
-        settings={'TIMEZONE': 'Asia/Kolkata', 'RETURN_AS_TIMEZONE_AWARE': True}
-    )
+    found_dates = await asyncio.to_thread(_search_dates, transcript)
 
     if not found_dates:
         raise HTTPException(status_code=400, detail=f"Could not extract a valid time from the audio: '{transcript}'")
@@ -394,33 +605,41 @@ async def parse_schedule(audio_file: UploadFile = File(...)):
 
     return {"parsed_time": parsed_time.isoformat(), "human_text": transcript}
 
+def _search_dates(text: str):
+    # dateparser loads its language data on import, so keep it off the startup path
+    from dateparser.search import search_dates
+    return search_dates(text, languages=DATEPARSER_LANGUAGES, settings=DATEPARSER_SETTINGS)
+
+def _warmup_dateparser():
+    try:
+        _search_dates("tomorrow at 5 pm")
+    except Exception as e:
+        print(f"dateparser warmup failed: {e}")
+
 class ConfirmPostRequest(BaseModel):
     platform: str
     text: str
     scheduled_time: Optional[str] = None
     user_id: str
 
-def scheduled_publish_job(platform: str, text: str, user_id: str):
-    db = SessionLocal()
+async def scheduled_publish_job(platform: str, text: str, user_id: str):
     try:
-        creds = db.query(SocialCreds).filter(SocialCreds.user_id == user_id).first()
+        creds = await get_user_creds(user_id)
         if not creds:
             print(f"[Scheduled Job] No credentials for user {user_id}")
             return
-        result = asyncio.run(social_publisher.publish_to_platform(platform.lower(), text, creds))
+        result = await social_publisher.publish_to_platform(platform.lower(), text, creds)
         # Save to memory if successful
         if result and result.get("status") == "success":
             memory_text = f"[{platform.capitalize()} Post History]: {text}"
-            vector_store.add_text_to_index([memory_text], user_id=user_id)
+            await add_to_memory([memory_text], user_id=user_id)
     except Exception as e:
         print(f"[Scheduled Job] Error: {e}")
-    finally:
-        db.close()
 
 @app.post("/confirm-post")
-async def confirm_post(request: ConfirmPostRequest, db: Session = Depends(get_db)):
+async def confirm_post(request: ConfirmPostRequest):
     if not request.scheduled_time:
-        creds = db.query(SocialCreds).filter(SocialCreds.user_id == request.user_id).first()
+        creds = await get_user_creds(request.user_id)
         if not creds:
             raise HTTPException(status_code=404, detail="User credentials not found")
         result = await social_publisher.publish_to_platform(
@@ -431,8 +650,10 @@ async def confirm_post(request: ConfirmPostRequest, db: Session = Depends(get_db
         # Save to memory if successful
         if result and result.get("status") == "success":
             memory_text = f"[{request.platform.capitalize()} Post History]: {request.text}"
-            vector_store.add_text_to_index([memory_text], user_id=request.user_id)
+            await add_to_memory([memory_text], user_id=request.user_id)
         return {"status": "published_immediately", "result": result}
+    if not scheduler:
+        raise HTTPException(status_code=503, detail="Scheduling is disabled on this server.")
     try:
         dt = datetime.fromisoformat(request.scheduled_time)
         scheduler.add_job(
@@ -1,5 +1,6 @@
 import os
 import httpx
+from fastapi import UploadFile
 
 # Read Deepgram API key from environment
 DEEPGRAM_API_KEY = os.getenv("DEEPGRAM_API_KEY")
@@ -7,34 +8,41 @@ DEEPGRAM_API_KEY = os.getenv("DEEPGRAM_API_KEY")
 if not DEEPGRAM_API_KEY:
     raise ValueError("DEEPGRAM_API_KEY must be set in the environment.")
 
-async def transcribe_audio_bytes(audio_bytes: bytes, content_type: str = "audio/wav") -> str:
+# Shared Deepgram client so TLS connections are reused across requests
+_deepgram_client = httpx.AsyncClient(
+    base_url="https://api.deepgram.com/v1/",
+    headers={"Authorization": f"Token {DEEPGRAM_API_KEY}"},
+    timeout=60.0 # Generous timeout in case of long audio
+)
+
+# Size of each chunk read from the upload and forwarded to Deepgram
+AUDIO_CHUNK_SIZE = 64 * 1024
+
+async def transcribe_audio_stream(audio_file: UploadFile) -> str:
     """
-    Asynchronously transcribes audio bytes using the Deepgram REST API via httpx.
+    Asynchronously transcribes an uploaded audio file using the Deepgram REST API via httpx.
+    The file is forwarded in chunks (chunked transfer encoding) instead of being read into memory.
     
     Args:
-        audio_bytes (bytes): The audio file content in bytes.
-        content_type (str): The mimetype of the audio file.
+        audio_file (UploadFile): The uploaded audio file.
         
     Returns:
         str: The transcribed text.
     """
     # Deepgram API endpoint with nova-3 and smart_format
-    url = "https://api.deepgram.com/v1/listen?model=nova-3&smart_format=true"
+    url = "listen?model=nova-3&smart_format=true"
     
     headers = {
-        "Authorization": f"Token {DEEPGRAM_API_KEY}",
-        "Content-Type": content_type
+        "Content-Type": audio_file.content_type or "audio/wav"
     }
     
     try:
-        # Use httpx async client for making the REST HTTP call
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                url,
-                headers=headers,
-                content=audio_bytes,
-                timeout=60.0 # Generous timeout in case of long audio
-            )
+        # Use the shared httpx async client for making the REST HTTP call
+        response = await _deepgram_client.post(
+            url,
+            headers=headers,
+            content=_iter_upload(audio_file)
+        )
             
         response.raise_for_status()
         
@@ -50,3 +58,11 @@ async def transcribe_audio_bytes(audio_bytes: bytes, content_type: str = "audio/
     except Exception as e:
         print(f"Deepgram transcription processing error: {e}")
         return f"Error transcribing audio: {str(e)}"
+
+async def _iter_upload(audio_file: UploadFile):
+    while chunk := await audio_file.read(AUDIO_CHUNK_SIZE):
+        yield chunk
+
+async def close() -> None:
+    """Closes the shared Deepgram client; called on application shutdown."""
+    await _deepgram_client.aclose()
@@ -1,43 +1,138 @@
+import os
+import json
+import threading
 import faiss
 import numpy as np
 from sentence_transformers import SentenceTransformer
 from typing import List, Dict, Any, Tuple
+from database import INDEX_PATH, TEXT_STORE_PATH, stage_file
 
 print("Loading SentenceTransformer model 'all-MiniLM-L6-v2'...")
 model = SentenceTransformer('all-MiniLM-L6-v2')
 embedding_dimension = model.get_sentence_embedding_dimension()
+EMBEDDING_BATCH_SIZE = 64
 
 index = faiss.IndexFlatL2(embedding_dimension)
 text_store: List[Tuple[str, str]] = []  # (text, user_id)
 
+# Callers run these functions in worker threads; FAISS is not safe for concurrent
+# add/search, and index positions must stay aligned with text_store
+index_lock = threading.Lock()
+# Inserts only mark the store dirty; persist_index writes it out later, away from searches
+_dirty = False
+# One writer at a time for the files on disk, so readers of the pair see matching files
+_persist_lock = threading.Lock()
+
 def add_text_to_index(text_list: List[str], user_id: str) -> None:
+    global _dirty
     if not text_list:
         return
-    embeddings = model.encode(text_list)
+    # One batched forward pass for the whole list instead of one per text
+    embeddings = model.encode(
+        text_list,
+        batch_size=EMBEDDING_BATCH_SIZE,
+        convert_to_numpy=True,
+        normalize_embeddings=True
+    )
     embeddings = np.array(embeddings).astype('float32')
-    index.add(embeddings)
-    for text in text_list:
-        text_store.append((text, user_id))
+    with index_lock:
+        index.add(embeddings)
+        for text in text_list:
+            text_store.append((text, user_id))
+        _dirty = True
+
+def load_index() -> None:
+    """Loads the persisted index and text store from disk, if present, replacing the in-memory ones."""
+    global index
+    if not (os.path.exists(INDEX_PATH) and os.path.exists(TEXT_STORE_PATH)):
+        print("No persisted vector index found; starting with an empty one.")
+        return
+    try:
+        loaded_index = faiss.read_index(INDEX_PATH)
+        with open(TEXT_STORE_PATH, "r", encoding="utf-8") as f:
+            loaded_texts = [tuple(entry) for entry in json.load(f)]
+    except Exception as e:
+        print(f"Error loading persisted vector index, starting with an empty one: {e}")
+        return
+    if loaded_index.ntotal != len(loaded_texts) or loaded_index.d != embedding_dimension:
+        print("Persisted vector index does not match its text store; starting with an empty one.")
+        return
+    with index_lock:
+        index = loaded_index
+        text_store[:] = loaded_texts
+    print(f"Loaded persisted vector index with {index.ntotal} entries.")
+
+def persist_index() -> None:
+    """
+    Writes the index and text store to disk if they changed since the last write.
+    Only the in-memory snapshot is taken under index_lock; the disk write happens outside it.
+    """
+    global _dirty
+    with _persist_lock:
+        with index_lock:
+            if not _dirty:
+                return
+            index_bytes = faiss.serialize_index(index)
+            texts = list(text_store)
+            _dirty = False
+        try:
+            # Write to temp files first so a crash never leaves a half-written pair behind
+            index_bytes.tofile(INDEX_PATH + ".tmp")
+            with open(TEXT_STORE_PATH + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(texts, f)
+            os.replace(INDEX_PATH + ".tmp", INDEX_PATH)
+            os.replace(TEXT_STORE_PATH + ".tmp", TEXT_STORE_PATH)
+        except Exception as e:
+            print(f"Error persisting vector index: {e}")
+            with index_lock:
+                _dirty = True
 
-def search_index(query_text: str, top_k: int = 3, user_id: str = None) -> List[Dict[str, Any]]:
+def stage_index_files() -> None:
+    """Persists pending changes, then copies the index and text store into the sync folder as a matching pair."""
+    persist_index()
+    # persist_index replaces both files under _persist_lock, so holding it keeps the copies in step
+    with _persist_lock:
+        for path in (INDEX_PATH, TEXT_STORE_PATH):
+            if os.path.exists(path):
+                stage_file(path)
+
+def warmup() -> None:
+    """Runs one throwaway encode so the first real request doesn't pay the model's warmup cost."""
+    try:
+        model.encode(["warmup"], normalize_embeddings=True)
+    except Exception as e:
+        print(f"Embedding model warmup failed: {e}")
+
+def embed_query(query_text: str) -> np.ndarray:
+    """Returns the normalized float32 embedding of a query, shape (1, dim)."""
+    query_embedding = model.encode([query_text], normalize_embeddings=True)
+    return np.array(query_embedding).astype('float32')
+
+def search_index(
+    query_text: str,
+    top_k: int = 3,
+    user_id: str = None,
+    query_embedding: np.ndarray = None
+) -> List[Dict[str, Any]]:
     if index.ntotal == 0:
         return []
-    query_embedding = model.encode([query_text])
-    query_embedding = np.array(query_embedding).astype('float32')
-    # ✅ Search a larger pool (50) to ensure we can find the user's docs after filtering
-    k = min(50, index.ntotal)
-    distances, indices = index.search(query_embedding, k)
-
+    if query_embedding is None:
+        query_embedding = embed_query(query_text)
     results = []
-    for i in range(k):
-        idx = indices[0][i]
-        if idx != -1 and idx < len(text_store):
-            text, stored_user_id = text_store[idx]
-            if user_id is None or stored_user_id == user_id:
-                results.append({
-                    "text": text,
-                    "distance": float(distances[0][i]),
-                    "user_id": stored_user_id
-                })
+    with index_lock:
+        # ✅ Search a larger pool (50) to ensure we can find the user's docs after filtering
+        k = min(50, index.ntotal)
+        distances, indices = index.search(query_embedding, k)
+
+        for i in range(k):
+            idx = indices[0][i]
+            if idx != -1 and idx < len(text_store):
+                text, stored_user_id = text_store[idx]
+                if user_id is None or stored_user_id == user_id:
+                    results.append({
+                        "text": text,
+                        "distance": float(distances[0][i]),
+                        "user_id": stored_user_id
+                    })
     # Now limit to top_k after filtering
     return results[:top_k]
\ No newline at end of file